@@ -3,56 +3,152 @@ from tkinter import filedialog, messagebox, ttk
 import json
 import struct
 import os
+import io
+import tempfile
+import stat
+import zlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from PIL import Image, ImageTk
 
 MODA_MAGIC = b'MODA'
+_U16 = struct.Struct(">H")
+_U32 = struct.Struct(">I")
+COPY_BUFSIZE = 1 << 20
+CODECS = ("none", "zlib")
+ZLIB_LEVEL = 1  # Fast; audio payloads rarely gain much from higher levels
+MAX_READERS = 8
 
 class ModaCompiler:
     @staticmethod
-    def build_moda_file(tracks, play_mode, thumbnail_path, output_path):
+    def build_moda_file(tracks, play_mode, thumbnail_path, output_path, codec="none"):
+        if codec not in CODECS:
+            raise ValueError(f"Unsupported codec: {codec}")
         meta = {
             "play_mode": play_mode,
             "tracks": [{"file": os.path.basename(t), "order": i+1} for i, t in enumerate(tracks)],
-            "thumbnail": os.path.basename(thumbnail_path) if thumbnail_path else None
+            "thumbnail": os.path.basename(thumbnail_path) if thumbnail_path else None,
+            "codec": codec,
+            "checksum": "crc32"
         }
-        meta_json = json.dumps(meta, indent=2).encode('utf-8')
-        
-        moda_data = bytearray()
-        moda_data += MODA_MAGIC
-        moda_data += struct.pack(">I", len(meta_json))  # JSON length (4 bytes)
-        moda_data += meta_json
-
-        # Add thumbnail
-        if thumbnail_path:
-            with open(thumbnail_path, 'rb') as f:
-                thumb_data = f.read()
-            thumb_name = os.path.basename(thumbnail_path).encode('utf-8')
-            moda_data += struct.pack(">H", len(thumb_name))  # Name length (2 bytes)
-            moda_data += thumb_name
-            moda_data += struct.pack(">I", len(thumb_data))  # Data length (4 bytes)
-            moda_data += thumb_data
-        else:
-            moda_data += struct.pack(">H", 0)  # No thumbnail
-
-        # Add tracks
-        moda_data += struct.pack(">H", len(tracks))  # Track count (2 bytes)
-        for tpath in tracks:
-            with open(tpath, 'rb') as f:
-                tdata = f.read()
-            tname = os.path.basename(tpath).encode('utf-8')
-            moda_data += struct.pack(">H", len(tname))  # Name length (2 bytes)
-            moda_data += tname
-            moda_data += struct.pack(">I", len(tdata))  # Data length (4 bytes)
-            moda_data += tdata
-
-        with open(output_path, 'wb') as f:
-            f.write(moda_data)
+        meta_json = json.dumps(meta, separators=(',', ':')).encode('utf-8')
+
+        # Write to a temporary file next to the target and only replace it once
+        # everything has been written, so a failed save keeps any existing file.
+        # Resolve symlinks first so a linked target is updated, not replaced.
+        output_path = os.path.realpath(output_path)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(output_path) or '.')
+        try:
+            # Stream everything straight to disk instead of building it in memory,
+            # copying every payload through one reusable buffer
+            buf = memoryview(bytearray(COPY_BUFSIZE))
+            with open(fd, 'wb', buffering=0) as raw, io.BufferedWriter(raw, COPY_BUFSIZE) as bw:
+                bw.write(MODA_MAGIC)
+                bw.write(_U32.pack(len(meta_json)))  # JSON length (4 bytes)
+                bw.write(meta_json)
+
+                # Add thumbnail
+                if thumbnail_path:
+                    with open(thumbnail_path, 'rb', buffering=0) as f:
+                        name = os.path.basename(thumbnail_path).encode('utf-8')
+                        _write_record(bw, buf, name, f, os.fstat(f.fileno()).st_size)
+                else:
+                    bw.write(_U16.pack(0))  # No thumbnail
+
+                # Add tracks. They are prepared on a small pool so the OS can
+                # fetch (and zlib compress) several files at once, then copied
+                # out in order one chunk at a time.
+                bw.write(_U16.pack(len(tracks)))  # Track count (2 bytes)
+                workers = max(1, min(MAX_READERS, len(tracks)))
+                with ThreadPoolExecutor(max_workers=workers) as pool:
+                    pending = deque()
+                    try:
+                        for tpath in tracks:
+                            pending.append(pool.submit(_prepare_track, tpath, codec))
+                            if len(pending) > workers:
+                                _write_track(bw, buf, *pending.popleft().result())
+                        while pending:
+                            _write_track(bw, buf, *pending.popleft().result())
+                    finally:
+                        # Only reached with work left over if writing failed
+                        for future in pending:
+                            if future.exception() is None:
+                                future.result()[1].close()
+            os.chmod(tmp_path, _output_mode(output_path))  # mkstemp always uses 0600
+            os.replace(tmp_path, output_path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+def _output_mode(path):
+    """Permissions for a saved file: the existing file's, else the umask default."""
+    try:
+        return stat.S_IMODE(os.stat(path).st_mode)
+    except FileNotFoundError:
+        umask = os.umask(0)
+        os.umask(umask)
+        return 0o666 & ~umask
+
+def _prepare_track(path, codec):
+    """Get one track ready to be copied into the output.
+
+    Runs on the reader pool. Returns the encoded name, an open file holding
+    the data to store, and its size. Without a codec that is the source file
+    itself, with the OS asked to start reading it ahead. With zlib it is a
+    spooled temporary file holding the compressed data, which only spills to
+    disk for large tracks.
+    """
+    name = os.path.basename(path).encode('utf-8')
+    f = open(path, 'rb', buffering=0)
+    if codec != "zlib":
+        if hasattr(os, "posix_fadvise"):
+            os.posix_fadvise(f.fileno(), 0, 0, os.POSIX_FADV_WILLNEED)
+        return name, f, os.fstat(f.fileno()).st_size
+    out = tempfile.SpooledTemporaryFile(max_size=COPY_BUFSIZE)
+    try:
+        with f:
+            comp = zlib.compressobj(ZLIB_LEVEL)
+            buf = memoryview(bytearray(COPY_BUFSIZE))  # One per job; jobs run concurrently
+            while n := f.readinto(buf):
+                out.write(comp.compress(buf[:n]))
+            out.write(comp.flush())
+        size = out.tell()
+        out.seek(0)
+        return name, out, size
+    except BaseException:
+        out.close()
+        raise
+
+def _write_record(bw, buf, name, src, size, with_crc=False):
+    """Write a name/length/data record, copying the data from `src` through `buf`.
+
+    With `with_crc`, the CRC-32 of the data is written right after it.
+    """
+    # Name length (2 bytes), name, data length (4 bytes) in a single write
+    bw.write(struct.pack(f">H{len(name)}sI", len(name), name, size))
+    crc = 0
+    remaining = size
+    while remaining > 0:
+        n = src.readinto(buf[:min(len(buf), remaining)])
+        if not n:
+            raise ValueError(f"{name.decode('utf-8')} changed while building")
+        bw.write(buf[:n])
+        if with_crc:
+            crc = zlib.crc32(buf[:n], crc)
+        remaining -= n
+    if with_crc:
+        bw.write(_U32.pack(crc))  # CRC-32 of the stored data (4 bytes)
+
+def _write_track(bw, buf, name, src, size):
+    """Write a prepared track record, followed by its CRC, and close its source."""
+    with src:
+        _write_record(bw, buf, name, src, size, with_crc=True)
 
 class ModaCompilerApp:
     def __init__(self, root):
         self.root = root
         self.root.title("MODA Compiler 🔊")
-        self.root.geometry("600x500")
+        self.root.geometry("600x570")
         
         style = ttk.Style()
         style.configure('TButton', font=('Helvetica', 10))
@@ -61,6 +157,7 @@ class ModaCompilerApp:
         self.tracks = []
         self.thumbnail = None
         self.play_mode = tk.StringVar(value="sequential")
+        self.compress = tk.BooleanVar(value=False)
         self.thumbnail_preview = None
 
         # Main Frame
@@ -84,6 +181,12 @@ class ModaCompilerApp:
         ttk.Radiobutton(mode_frame, text="Sequential (play one by one)", variable=self.play_mode, value="sequential").pack(anchor=tk.W)
         ttk.Radiobutton(mode_frame, text="Parallel (play all together)", variable=self.play_mode, value="parallel").pack(anchor=tk.W)
 
+        # Compression
+        codec_frame = ttk.LabelFrame(main_frame, text="🗜️ Compression", padding="10")
+        codec_frame.pack(fill=tk.X, pady=5)
+        
+        ttk.Checkbutton(codec_frame, text="Compress tracks (zlib)", variable=self.compress).pack(anchor=tk.W)
+
         # Thumbnail Section
         thumb_frame = ttk.LabelFrame(main_frame, text="🖼️ Thumbnail", padding="10")
         thumb_frame.pack(fill=tk.X, pady=5)
@@ -102,8 +205,7 @@ class ModaCompilerApp:
         )
         if files:
             self.tracks.extend(files)
-            for f in files:
-                self.track_list.insert(tk.END, os.path.basename(f))
+            self.track_list.insert(tk.END, *map(os.path.basename, files))
 
     def remove_track(self):
         selection = self.track_list.curselection()
@@ -144,7 +246,8 @@ class ModaCompilerApp:
                     self.tracks,
                     self.play_mode.get(),
                     self.thumbnail,
-                    file
+                    file,
+                    codec="zlib" if self.compress.get() else "none"
                 )
                 messagebox.showinfo("Success", f"MODA file saved successfully:\n{file}")
             except Exception as e:
@@ -3,44 +3,81 @@ from tkinter import filedialog, messagebox, ttk
 import struct
 import json
 import os
+import mmap
+import platform
+import zlib
 import shutil
 from PIL import Image, ImageTk
 
 MODA_MAGIC = b'MODA'
+_U16 = struct.Struct(">H")
+_U32 = struct.Struct(">I")
+USE_SENDFILE = platform.system() == "Linux"
+COPY_BUFSIZE = 1 << 20
+CODECS = ("none", "zlib")
 
 class ModaDecompiler:
     @staticmethod
-    def extract_moda(filepath, output_dir):
+    def extract_moda(filepath, output_dir, start_offset=None, meta=None):
+        """Extract a .moda file into output_dir.
+
+        If the caller has already parsed the metadata, pass it as `meta`
+        together with `start_offset` (the offset just past the JSON) to
+        skip parsing the header again. They are only trusted while the JSON
+        length stored in the file still ends at `start_offset`.
+        """
         try:
-            with open(filepath, 'rb') as f:
-                magic = f.read(4)
-                if magic != MODA_MAGIC:
+            with open(filepath, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                if mm[0:4] != MODA_MAGIC:
                     raise ValueError("Not a valid MODA file")
                 
                 # Read JSON metadata
-                json_len = struct.unpack(">I", f.read(4))[0]
-                meta_json = f.read(json_len).decode('utf-8')
-                meta = json.loads(meta_json)
+                json_len = _U32.unpack_from(mm, 4)[0]
+                if meta is None or start_offset != 8 + json_len:
+                    p = 8
+                    meta_json = mm[p:p + json_len]
+                    p += json_len
+                    meta = json.loads(meta_json)
+                else:
+                    p = start_offset
+                codec = meta.get("codec", "none")
+                if codec not in CODECS:
+                    raise ValueError(f"Unsupported codec: {codec}")
+                checksum = meta.get("checksum")
+                if checksum not in (None, "crc32"):
+                    raise ValueError(f"Unsupported checksum: {checksum}")
                 
                 # Read thumbnail
-                thumb_name_len = struct.unpack(">H", f.read(2))[0]
+                thumb_name_len = _U16.unpack_from(mm, p)[0]
+                p += 2
                 if thumb_name_len > 0:
-                    thumb_name = f.read(thumb_name_len).decode('utf-8')
-                    thumb_size = struct.unpack(">I", f.read(4))[0]
-                    thumb_data = f.read(thumb_size)
-                    with open(os.path.join(output_dir, thumb_name), 'wb') as thumb_file:
-                        thumb_file.write(thumb_data)
+                    thumb_name = mm[p:p + thumb_name_len].decode('utf-8')
+                    p += thumb_name_len
+                    thumb_size = _U32.unpack_from(mm, p)[0]
+                    p += 4
+                    _write_payload(os.path.join(output_dir, thumb_name), f.fileno(), mm, p, thumb_size)
+                    p += thumb_size
                 
                 # Read tracks
-                track_count = struct.unpack(">H", f.read(2))[0]
+                track_count = _U16.unpack_from(mm, p)[0]
+                p += 2
                 for _ in range(track_count):
-                    track_name_len = struct.unpack(">H", f.read(2))[0]
-                    track_name = f.read(track_name_len).decode('utf-8')
-                    track_size = struct.unpack(">I", f.read(4))[0]
-                    track_data = f.read(track_size)
-                    
-                    with open(os.path.join(output_dir, track_name), 'wb') as track_file:
-                        track_file.write(track_data)
+                    track_name_len = _U16.unpack_from(mm, p)[0]
+                    p += 2
+                    track_name = mm[p:p + track_name_len].decode('utf-8')
+                    p += track_name_len
+                    track_size = _U32.unpack_from(mm, p)[0]
+                    p += 4
+                    if checksum:
+                        _verify_crc(mm, p, track_size, track_name)
+                    track_path = os.path.join(output_dir, track_name)
+                    if codec == "zlib":
+                        _inflate_payload(track_path, mm, p, track_size)
+                    else:
+                        _write_payload(track_path, f.fileno(), mm, p, track_size)
+                    p += track_size
+                    if checksum:
+                        p += 4
                 
                 # Save metadata as JSON
                 with open(os.path.join(output_dir, "meta.json"), 'w') as meta_file:
@@ -50,6 +87,50 @@ class ModaDecompiler:
         except Exception as e:
             raise ValueError(f"Error extracting MODA file: {str(e)}")
 
+def _write_payload(path, src_fd, mm, offset, size):
+    """Write `size` bytes of the mapped input starting at `offset` to `path`."""
+    if offset + size > len(mm):
+        raise ValueError("Unexpected end of MODA file")
+    with open(path, 'wb') as f:
+        if USE_SENDFILE:
+            # Let the kernel copy straight from the input file
+            out_fd = f.fileno()
+            while size > 0:
+                sent = os.sendfile(out_fd, src_fd, offset, size)
+                if sent == 0:
+                    raise ValueError("Unexpected end of MODA file")
+                offset += sent
+                size -= sent
+        else:
+            with memoryview(mm) as view:
+                f.write(view[offset:offset + size])
+
+def _verify_crc(mm, offset, size, name):
+    """Check a payload against the CRC-32 stored right after it."""
+    if offset + size + 4 > len(mm):
+        raise ValueError("Unexpected end of MODA file")
+    with memoryview(mm) as view:
+        crc = zlib.crc32(view[offset:offset + size])
+    if crc != _U32.unpack_from(mm, offset + size)[0]:
+        raise ValueError(f"Checksum mismatch in {name}")
+
+def _inflate_payload(path, mm, offset, size):
+    """Decompress a zlib payload of the mapped input to `path`."""
+    if offset + size > len(mm):
+        raise ValueError("Unexpected end of MODA file")
+    decomp = zlib.decompressobj()
+    with open(path, 'wb') as f, memoryview(mm) as view:
+        for start in range(offset, offset + size, COPY_BUFSIZE):
+            f.write(decomp.decompress(view[start:min(start + COPY_BUFSIZE, offset + size)]))
+        f.write(decomp.flush())
+    if not decomp.eof:
+        raise ValueError("Truncated track data")
+
+def _file_stamp(path):
+    """Size and modification time, used to tell whether a file has changed."""
+    st = os.stat(path)
+    return st.st_size, st.st_mtime_ns
+
 class ModaDecompilerApp:
     def __init__(self, root):
         self.root = root
@@ -95,6 +176,9 @@ class ModaDecompilerApp:
         
         self.current_file = None
         self.output_dir = None
+        self._meta = None
+        self._payload_offset = None
+        self._file_stamp = None
     
     def open_file(self):
         file = filedialog.askopenfilename(
@@ -104,6 +188,9 @@ class ModaDecompilerApp:
         if file:
             self.current_file = file
             self.file_label.config(text=os.path.basename(file))
+            self._meta = None
+            self._payload_offset = None
+            self._file_stamp = None
             
             # Try to read basic info without full extraction
             try:
@@ -112,10 +199,15 @@ class ModaDecompilerApp:
                     if magic != MODA_MAGIC:
                         raise ValueError("Not a valid MODA file")
                     
-                    json_len = struct.unpack(">I", f.read(4))[0]
-                    meta_json = f.read(json_len).decode('utf-8')
+                    json_len = _U32.unpack(f.read(4))[0]
+                    meta_json = f.read(json_len)
                     meta = json.loads(meta_json)
                     
+                    # Remember where the header ends so extraction can skip it
+                    self._meta = meta
+                    self._payload_offset = f.tell()
+                    self._file_stamp = _file_stamp(file)
+                    
                     self.mode_label.config(text=f"Play Mode: {meta.get('play_mode', 'unknown')}")
                     self.tracks_label.config(text=f"Tracks: {len(meta.get('tracks', []))}")
             except Exception as e:
@@ -139,8 +231,18 @@ class ModaDecompilerApp:
             # Create output directory if it doesn't exist
             os.makedirs(self.output_dir, exist_ok=True)
             
+            # Drop the cached header if the file was re-saved since it was opened
+            if self._file_stamp != _file_stamp(self.current_file):
+                self._meta = None
+                self._payload_offset = None
+            
             # Extract files
-            meta = ModaDecompiler.extract_moda(self.current_file, self.output_dir)
+            meta = ModaDecompiler.extract_moda(
+                self.current_file,
+                self.output_dir,
+                start_offset=self._payload_offset,
+                meta=self._meta
+            )
             
             messagebox.showinfo(
                 "Success", 
@@ -3,124 +3,197 @@ from tkinter import filedialog, messagebox, ttk
 import struct
 import json
 import os
+import io
+import mmap
 import tempfile
+import zlib
 from PIL import Image, ImageTk
 import pygame
 from pygame import mixer
-import threading
-import time
 
 MODA_MAGIC = b'MODA'
+_U16 = struct.Struct(">H")
+_U32 = struct.Struct(">I")
+CODECS = ("none", "zlib")
 
 class ModaPlayer:
     def __init__(self):
-        pygame.init()
-        mixer.init(frequency=44100, size=-16, channels=2, buffer=4096)
+        self._mixer_ready = False
         self.temp_dir = None
         self.current_track = 0
         self.is_playing = False
         self.tracks_meta = []
         self.play_mode = ""
-        self.thumbnail_path = None
-        self.audio_threads = []
+        self.thumbnail_bytes = None
         self.sound_objects = []
+        self._sound_cache = {}
+        self._channel = None
+        self._queued_track = None
+        self._file = None
+        self._mm = None
+        self._track_offsets = []
+        self._codec = "none"
 
     def load_moda(self, filepath):
         try:
-            with open(filepath, 'rb') as f:
-                magic = f.read(4)
-                if magic != MODA_MAGIC:
-                    raise ValueError("Not a valid MODA file")
-                
-                # Read JSON metadata
-                json_len = struct.unpack(">I", f.read(4))[0]
-                meta_json = f.read(json_len).decode('utf-8')
-                meta = json.loads(meta_json)
-                self.play_mode = meta.get("play_mode", "sequential")
-                self.tracks_meta = meta.get("tracks", [])
-                
-                # Read thumbnail
-                thumb_name_len = struct.unpack(">H", f.read(2))[0]
-                if thumb_name_len > 0:
-                    thumb_name = f.read(thumb_name_len).decode('utf-8')
-                    thumb_size = struct.unpack(">I", f.read(4))[0]
-                    thumb_data = f.read(thumb_size)
-                    self.thumbnail_path = os.path.join(tempfile.gettempdir(), thumb_name)
-                    with open(self.thumbnail_path, 'wb') as thumb_file:
-                        thumb_file.write(thumb_data)
-                
-                # Create temp dir for audio files
-                self.temp_dir = tempfile.mkdtemp(prefix="moda_")
-                
-                # Read tracks
-                track_count = struct.unpack(">H", f.read(2))[0]
-                for _ in range(track_count):
-                    track_name_len = struct.unpack(">H", f.read(2))[0]
-                    track_name = f.read(track_name_len).decode('utf-8')
-                    track_size = struct.unpack(">I", f.read(4))[0]
-                    track_data = f.read(track_size)
-                    
-                    track_path = os.path.join(self.temp_dir, track_name)
-                    with open(track_path, 'wb') as track_file:
-                        track_file.write(track_data)
-                
-                return meta
+            # Keep the file mapped; payloads are only read when a track is played
+            self._file = open(filepath, 'rb')
+            self._mm = mm = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+            if mm[0:4] != MODA_MAGIC:
+                raise ValueError("Not a valid MODA file")
+            
+            # Read JSON metadata
+            json_len = _U32.unpack_from(mm, 4)[0]
+            p = 8
+            meta_json = mm[p:p + json_len]
+            p += json_len
+            meta = json.loads(meta_json)
+            self.play_mode = meta.get("play_mode", "sequential")
+            self.tracks_meta = meta.get("tracks", [])
+            self._codec = meta.get("codec", "none")
+            if self._codec not in CODECS:
+                raise ValueError(f"Unsupported codec: {self._codec}")
+            checksum = meta.get("checksum")
+            if checksum not in (None, "crc32"):
+                raise ValueError(f"Unsupported checksum: {checksum}")
+            
+            # Read thumbnail
+            thumb_name_len = _U16.unpack_from(mm, p)[0]
+            p += 2
+            if thumb_name_len > 0:
+                p += thumb_name_len  # The name is only needed when extracting
+                thumb_size = _U32.unpack_from(mm, p)[0]
+                p += 4
+                if p + thumb_size > len(mm):
+                    raise ValueError("Unexpected end of MODA file")
+                self.thumbnail_bytes = mm[p:p + thumb_size]
+                p += thumb_size
+            else:
+                self.thumbnail_bytes = None
+            
+            # Index tracks as (name, offset, size, crc); crc is None in older files
+            self._track_offsets = []
+            track_count = _U16.unpack_from(mm, p)[0]
+            p += 2
+            for _ in range(track_count):
+                track_name_len = _U16.unpack_from(mm, p)[0]
+                p += 2
+                track_name = mm[p:p + track_name_len].decode('utf-8')
+                p += track_name_len
+                track_size = _U32.unpack_from(mm, p)[0]
+                p += 4
+                end = p + track_size + (4 if checksum else 0)
+                if end > len(mm):
+                    raise ValueError("Unexpected end of MODA file")
+                crc = _U32.unpack_from(mm, p + track_size)[0] if checksum else None
+                self._track_offsets.append((track_name, p, track_size, crc))
+                p = end
+            
+            return meta
         except Exception as e:
+            self._close()
             raise ValueError(f"Error loading MODA file: {str(e)}")
 
+    def _ensure_mixer(self):
+        """Start pygame's audio on first playback instead of at startup"""
+        if not self._mixer_ready:
+            mixer.pre_init(frequency=44100, size=-16, channels=2, buffer=4096)
+            pygame.init()
+            mixer.init()
+            self._mixer_ready = True
+
+    def _get_sound(self, index):
+        """Return a Sound for the track at index, decoding it only the first time"""
+        sound = self._sound_cache.get(index)
+        if sound is None:
+            name, data = self._track_data(index)
+            try:
+                sound = mixer.Sound(file=io.BytesIO(data))
+            except pygame.error:
+                # Fall back to a real file for formats pygame can't read from a buffer
+                sound = mixer.Sound(self._extract_track(name, data))
+            self._sound_cache[index] = sound
+        return sound
+
+    def _track_data(self, index):
+        """Return the name and raw file bytes of the track at index"""
+        name, offset, size, crc = self._track_offsets[index]
+        with memoryview(self._mm) as view:
+            payload = view[offset:offset + size]
+            # Verified lazily so loading stays cheap; a bad track is just skipped
+            if crc is not None and zlib.crc32(payload) != crc:
+                raise ValueError("Checksum mismatch")
+            if self._codec == "zlib":
+                data = zlib.decompress(payload)
+            else:
+                data = payload.tobytes()
+            payload.release()
+        return name, data
+
+    def _extract_track(self, name, data):
+        """Write one track to the temp dir, creating it on first use"""
+        if self.temp_dir is None:
+            self.temp_dir = tempfile.mkdtemp(prefix="moda_")
+        track_path = os.path.join(self.temp_dir, name)
+        with open(track_path, 'wb') as track_file:
+            track_file.write(data)
+        return track_path
+
+    def _try_get_sound(self, index):
+        """Like _get_sound, but report a track that fails to decode and return None"""
+        try:
+            return self._get_sound(index)
+        except Exception as e:
+            print(f"Error loading track {self._track_offsets[index][0]}: {e}")
+            return None
+
+    def _load_sounds(self):
+        """Load a Sound for every track, skipping ones that fail to decode"""
+        sounds = (self._try_get_sound(i) for i in range(len(self._track_offsets)))
+        self.sound_objects = [sound for sound in sounds if sound is not None]
+
+    def _find_sound(self, start):
+        """Decode the first playable track from start on; returns (index, sound)"""
+        for i in range(start, len(self._track_offsets)):
+            sound = self._try_get_sound(i)
+            if sound is not None:
+                return i, sound
+        return None, None
+
     def play_parallel(self):
-        """Play all tracks simultaneously using multi-threading"""
+        """Play all tracks simultaneously, one mixer channel per track"""
+        self._ensure_mixer()
         self.stop()  # Stop any currently playing audio
+        self._load_sounds()
         
-        # Pre-load all sounds
-        self.sound_objects = []
-        for track in self.tracks_meta:
-            track_path = os.path.join(self.temp_dir, track["file"])
-            try:
-                sound = mixer.Sound(track_path)
-                self.sound_objects.append(sound)
-            except Exception as e:
-                print(f"Error loading track {track['file']}: {e}")
-                continue
+        # The mixer already plays channels concurrently, so start them all here
+        mixer.set_num_channels(max(8, len(self.sound_objects)))
+        for i, sound in enumerate(self.sound_objects):
+            mixer.Channel(i).play(sound)
         
-        # Create and start threads for each track
-        self.audio_threads = []
-        for sound in self.sound_objects:
-            thread = threading.Thread(target=self._play_sound, args=(sound,))
-            thread.daemon = True
-            self.audio_threads.append(thread)
-        
-        # Start all threads at the same time
-        for thread in self.audio_threads:
-            thread.start()
+        self.is_playing = bool(self.sound_objects)
+
+    def play_sequential(self):
+        """Play tracks one by one, decoding each just before it is needed"""
+        self._ensure_mixer()
+        self.stop()  # Stop any currently playing audio
+        index, sound = self._find_sound(0)
+        if sound is None:
+            return
         
+        self.current_track = index
+        self.sound_objects = [sound]  # Keep references to the playing and queued sounds
+        self._channel = mixer.Channel(0)
+        self._channel.play(sound)
+        self._queue_next()
         self.is_playing = True
 
-    def _play_sound(self, sound):
-        """Thread target function to play a sound"""
-        channel = mixer.find_channel()
-        if channel:
-            channel.play(sound)
-            while channel.get_busy():
-                time.sleep(0.1)
-
-    def play_sequential(self):
-        """Play tracks one by one"""
-        if self.current_track < len(self.tracks_meta):
-            track = self.tracks_meta[self.current_track]
-            track_path = os.path.join(self.temp_dir, track["file"])
-            try:
-                sound = mixer.Sound(track_path)
-                self.sound_objects = [sound]  # Keep reference to avoid garbage collection
-                channel = mixer.find_channel()
-                if channel:
-                    channel.play(sound)
-                    channel.set_endevent(pygame.USEREVENT)
-                    self.is_playing = True
-            except Exception as e:
-                print(f"Error playing track {track['file']}: {e}")
-                self.current_track += 1
-                self.play_sequential()
+    def _queue_next(self):
+        """Decode and queue the track after current_track so it starts without a gap"""
+        self._queued_track, sound = self._find_sound(self.current_track + 1)
+        if sound is not None:
+            self.sound_objects = self.sound_objects[-1:] + [sound]
+            self._channel.queue(sound)
 
     def play(self):
         if not self.tracks_meta:
@@ -132,30 +205,44 @@ class ModaPlayer:
             self.play_sequential()
     
     def stop(self):
-        mixer.stop()
+        if self._mixer_ready:
+            mixer.stop()
         self.is_playing = False
         self.current_track = 0
+        self._queued_track = None
         self.sound_objects = []  # Clear sound references
     
     def check_events(self):
-        for event in pygame.event.get():
-            if event.type == pygame.USEREVENT:
-                self.current_track += 1
-                if self.current_track < len(self.tracks_meta):
-                    self.play_sequential()
-                else:
-                    self.is_playing = False
-                    self.current_track = 0
+        if self.play_mode == "parallel":
+            self.is_playing = any(mixer.Channel(i).get_busy() for i in range(len(self.sound_objects)))
+            return self.is_playing
+        # The queued sound has started once the channel's queue is empty
+        if self._channel.get_queue() is None and self._queued_track is not None:
+            self.current_track = self._queued_track
+            self._queue_next()
+        if not self._channel.get_busy():
+            self.is_playing = False
+            self.current_track = 0
         return self.is_playing
 
+    def _close(self):
+        if self._mm is not None:
+            self._mm.close()
+            self._mm = None
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        self._track_offsets = []
+
     def cleanup(self):
         self.stop()
+        self._sound_cache.clear()
+        self._close()
         if self.temp_dir and os.path.exists(self.temp_dir):
             for file in os.listdir(self.temp_dir):
                 os.remove(os.path.join(self.temp_dir, file))
             os.rmdir(self.temp_dir)
-        if self.thumbnail_path and os.path.exists(self.thumbnail_path):
-            os.remove(self.thumbnail_path)
+        self.temp_dir = None
 
 class ModaPlayerApp:
     def __init__(self, root):
@@ -166,6 +253,7 @@ class ModaPlayerApp:
         self.player = ModaPlayer()
         self.current_file = None
         self.thumbnail_img = None
+        self._poll_id = None
         
         style = ttk.Style()
         style.configure('TButton', font=('Helvetica', 10))
@@ -215,9 +303,6 @@ class ModaPlayerApp:
         
         self.track_list = tk.Listbox(track_frame)
         self.track_list.pack(fill=tk.BOTH, expand=True)
-        
-        # Update player events periodically
-        self.update_player()
     
     def open_file(self):
         file = filedialog.askopenfilename(
@@ -236,9 +321,9 @@ class ModaPlayerApp:
                 self.tracks_label.config(text=f"Tracks: {len(meta.get('tracks', []))}")
                 
                 # Load thumbnail
-                if self.player.thumbnail_path:
+                if self.player.thumbnail_bytes:
                     try:
-                        img = Image.open(self.player.thumbnail_path)
+                        img = Image.open(io.BytesIO(self.player.thumbnail_bytes))
                         img.thumbnail((300, 300))
                         self.thumbnail_img = ImageTk.PhotoImage(img)
                         self.thumb_label.config(image=self.thumbnail_img)
@@ -250,8 +335,8 @@ class ModaPlayerApp:
                 
                 # Populate track list
                 self.track_list.delete(0, tk.END)
-                for track in meta.get('tracks', []):
-                    self.track_list.insert(tk.END, f"{track['order']}. {track['file']}")
+                items = [f"{track['order']}. {track['file']}" for track in meta.get('tracks', [])]
+                self.track_list.insert(tk.END, *items)
                 
                 self.play_btn.config(state=tk.NORMAL)
                 self.stop_btn.config(state=tk.NORMAL)
@@ -261,9 +346,15 @@ class ModaPlayerApp:
     
     def play(self):
         if self.current_file:
-            self.player.play()
+            try:
+                self.player.play()
+            except pygame.error as e:
+                # The mixer is only started here, so a missing audio device surfaces now
+                messagebox.showerror("Error", f"Failed to start playback:\n{str(e)}")
+                return
             self.play_btn.config(state=tk.DISABLED)
             self.stop_btn.config(state=tk.NORMAL)
+            self.update_player()
     
     def stop(self):
         self.player.stop()
@@ -271,9 +362,12 @@ class ModaPlayerApp:
         self.stop_btn.config(state=tk.DISABLED)
     
     def update_player(self):
-        if self.player.is_playing:
-            self.player.check_events()
-        self.root.after(100, self.update_player)
+        # Only poll while something is playing; play() starts this again
+        if self._poll_id is not None:
+            self.root.after_cancel(self._poll_id)
+            self._poll_id = None
+        if self.player.is_playing and self.player.check_events():
+            self._poll_id = self.root.after(500, self.update_player)
     
     def on_close(self):
         self.player.cleanup()